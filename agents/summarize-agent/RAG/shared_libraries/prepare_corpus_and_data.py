@@ -13,22 +13,29 @@
 # limitations under the License.
 
 from google.auth import default
+from google.auth.credentials import with_scopes_if_required
+from google.auth.transport.requests import AuthorizedSession
 from google.api_core.exceptions import ResourceExhausted
 import vertexai
 from vertexai.preview import rag
 from vertexai.preview.rag import TransformationConfig, ChunkingConfig
 import os
 import time
-import json
+import uuid
+import orjson
+import functools
+import io
+import threading
 import base64
 from dotenv import load_dotenv, set_key
 import requests
+import shutil
 import tempfile
 from google.cloud import storage
 from google.cloud import documentai
-from google.api_core.client_options import ClientOptions
-from google.api_core.exceptions import FailedPrecondition
-from typing import List, Tuple
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple, Union
 
 # Load environment variables from .env file
 load_dotenv()
@@ -61,15 +68,81 @@ GCS_FOLDER_PATH = os.getenv("GCS_CORPUS_FOLDER_PATH", "")  # Optional subfolder
 # Document AI Configuration
 DOCAI_PROCESSOR_ID = os.getenv("DOCAI_PROCESSOR_ID")
 DOCAI_LOCATION = os.getenv("DOCAI_LOCATION", "us")
+DOCAI_MAX_WORKERS = int(os.getenv("DOCAI_MAX_WORKERS", "8"))  # Concurrent per-PDF workers and DocAI batches in the fallback
+IMPORT_POLL_INTERVAL = 10  # Seconds between reads of the partial failures sink during an import
+
+# Keep DocAI gRPC channels alive between calls from the fallback workers
+DOCAI_GRPC_OPTIONS = [
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.http2.min_ping_interval_without_data_ms", 10000),
+]
+
+# RAG import error message for PDFs that need the DocAI fallback
+PDF_NO_TEXT_MESSAGE = "PDF was invalid or file contains no text pages"
+_PDF_NO_TEXT_MESSAGE_BYTES = PDF_NO_TEXT_MESSAGE.encode()
+_INVALID_ARGUMENT_BYTES = b"INVALID_ARGUMENT"
 
 ENV_FILE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".env"))
 
 
 # --- Start of the script ---
-def initialize_vertex_ai():
+@functools.lru_cache(maxsize=1)
+def _get_credentials():
+  """Returns the application default credentials, resolved once per process."""
   credentials, _ = default()
+  return credentials
+
+
+@functools.lru_cache(maxsize=None)
+def _get_storage_client() -> storage.Client:
+  """Returns a shared Cloud Storage client, reused across calls and threads.
+
+  During an import, Cloud Storage is used by the shared per-PDF worker pool
+  (DOCAI_MAX_WORKERS threads), by up to DOCAI_MAX_WORKERS fallback batch threads
+  that clean up DocAI output, and by the thread polling the failures log. The
+  connection pool is sized for all of them so each keeps a keep-alive connection
+  instead of having it discarded when the pool is full. storage.Client only
+  accepts a custom session through its _http argument.
+  """
+  # storage.Client does not add its scopes to a custom session, so add them here
+  credentials = with_scopes_if_required(_get_credentials(), storage.Client.SCOPE)
+  session = AuthorizedSession(credentials)
+  pool_size = 2 * DOCAI_MAX_WORKERS + 1
+  session.mount(
+      "https://",
+      requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size),
+  )
+  return storage.Client(project=PROJECT_ID, credentials=credentials, _http=session)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_docai_client(location: str) -> documentai.DocumentProcessorServiceClient:
+  """Returns a shared Document AI client for the given location.
+
+  All callers share one gRPC channel with keepalive enabled.
+  """
+  host = f"{location}-documentai.googleapis.com"
+  transport_class = documentai.DocumentProcessorServiceClient.get_transport_class("grpc")
+  channel = transport_class.create_channel(
+      host, credentials=_get_credentials(), options=DOCAI_GRPC_OPTIONS
+  )
+  return documentai.DocumentProcessorServiceClient(
+      transport=transport_class(host=host, channel=channel)
+  )
+
+
+def _parse_gs_uri(uri: str) -> Tuple[str, str]:
+  """Split a gs://bucket/path URI into (bucket, path) with a single split."""
+  _, _, bucket_name, blob_path = uri.split("/", 3)
+  return bucket_name, blob_path
+
+
+def initialize_vertex_ai():
   vertexai.init(
-      project=PROJECT_ID, location=LOCATION, credentials=credentials
+      project=PROJECT_ID, location=LOCATION, credentials=_get_credentials()
   )
 
 
@@ -78,14 +151,13 @@ def create_or_get_corpus():
   embedding_model_config = rag.EmbeddingModelConfig(
       publisher_model="publishers/google/models/text-embedding-005"
   )
-  existing_corpora = rag.list_corpora()
-  corpus = None
-  for existing_corpus in existing_corpora:
-    if existing_corpus.display_name == CORPUS_DISPLAY_NAME:
-      corpus = existing_corpus
-      print(f"Found existing corpus with display name '{CORPUS_DISPLAY_NAME}'")
-      break
-  if corpus is None:
+  # Stop paging through corpora as soon as a match is found
+  corpus = next(
+      (c for c in rag.list_corpora() if c.display_name == CORPUS_DISPLAY_NAME), None
+  )
+  if corpus is not None:
+    print(f"Found existing corpus with display name '{CORPUS_DISPLAY_NAME}'")
+  else:
     corpus = rag.create_corpus(
         display_name=CORPUS_DISPLAY_NAME,
         description=CORPUS_DESCRIPTION,
@@ -100,17 +172,18 @@ def download_pdf_from_url(url, output_path):
   print(f"Downloading PDF from {url}...")
   response = requests.get(url, stream=True)
   response.raise_for_status()  # Raise an exception for HTTP errors
-  
+
+  # Copy the raw stream in 1 MiB blocks, decoding any gzip/deflate transfer encoding
+  response.raw.decode_content = True
   with open(output_path, 'wb') as f:
-    for chunk in response.iter_content(chunk_size=8192):
-      f.write(chunk)
+    shutil.copyfileobj(response.raw, f, length=1024 * 1024)
   
   print(f"PDF downloaded successfully to {output_path}")
   return output_path
 
 
-def upload_pdf_to_corpus(corpus_name, pdf_path, display_name, description):
-  """Uploads a PDF file to the specified corpus."""
+def upload_pdf_to_corpus(corpus_name, pdf_path, display_name, description, transformation_config=None):
+  """Uploads a PDF (or extracted text) file to the specified corpus."""
   print(f"Uploading {display_name} to corpus...")
   try:
     rag_file = rag.upload_file(
@@ -118,6 +191,7 @@ def upload_pdf_to_corpus(corpus_name, pdf_path, display_name, description):
         path=pdf_path,
         display_name=display_name,
         description=description,
+        transformation_config=transformation_config,
     )
     print(f"Successfully uploaded {display_name} to corpus")
     return rag_file
@@ -139,18 +213,28 @@ def update_env_file(corpus_name, env_file_path):
     except Exception as e:
         print(f"Error updating .env file: {e}")
 
-def list_corpus_files(corpus_name):
-  """Lists files in the specified corpus."""
-  files = list(rag.list_files(corpus_name=corpus_name))
-  print(f"Total files in corpus: {len(files)}")
-  for file in files:
-    print(f"File: {file.display_name} - {file.name}")
+def list_corpus_files(corpus_name, verbose=False):
+  """Counts files in the specified corpus, also printing each one when verbose is True."""
+  file_count = 0
+  for file in rag.list_files(corpus_name=corpus_name):
+    if verbose:
+      print(f"File: {file.display_name} - {file.name}")
+    file_count += 1
+  print(f"Total files in corpus: {file_count}")
 
 
 
+# Processor IDs already set up in this run, keyed by (project_id, location)
+_processor_ids = {}
+_processor_lock = threading.Lock()
+
+
 def setup_processor(project_id: str, location: str, processor_display_name: str = "Layout Parser Processor") -> str:
   """Setup a LAYOUT_PARSER_PROCESSOR - check if exists, create if needed, and ensure it's enabled.
 
+  The processor ID from DOCAI_PROCESSOR_ID is used as-is when set. Otherwise the
+  lookup runs once per (project_id, location) and successful results are cached.
+
   Args:
     project_id: Google Cloud project ID
     location: Processor location (e.g., 'us' or 'eu')
@@ -159,10 +243,24 @@ def setup_processor(project_id: str, location: str, processor_display_name: str
   Returns:
     The processor ID if successful, None otherwise
   """
+  if DOCAI_PROCESSOR_ID:
+    return DOCAI_PROCESSOR_ID
+
+  # Serialize lookups so concurrent workers don't each create a processor
+  with _processor_lock:
+    cache_key = (project_id, location)
+    if cache_key not in _processor_ids:
+      processor_id = _setup_processor(project_id, location, processor_display_name)
+      if not processor_id:
+        return None
+      _processor_ids[cache_key] = processor_id
+    return _processor_ids[cache_key]
+
+
+def _setup_processor(project_id: str, location: str, processor_display_name: str) -> str:
+  """Look up or create the layout parser processor and make sure it is enabled."""
   try:
-    # Set up client with proper endpoint
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    client = _get_docai_client(location)
 
     # List existing processors to check if one already exists
     parent = client.common_location_path(project_id, location)
@@ -215,46 +313,37 @@ def setup_processor(project_id: str, location: str, processor_display_name: str
     return None
 
 
-def process_pdf_with_layout_parser(pdf_gcs_path: str, chunk_size: int = 1024) -> str:
-  """Process PDF through Document AI Layout Parser.
+def process_pdfs_with_layout_parser(pdf_gcs_paths: List[str], processor_id: str, output_gcs_uri: str, chunk_size: int = 1024) -> Dict[str, str]:
+  """Process PDFs through Document AI Layout Parser in a single batch operation.
 
   Args:
-    pdf_gcs_path: GCS path to the PDF file (e.g., gs://bucket/file.pdf)
+    pdf_gcs_paths: GCS paths to the PDF files (e.g., gs://bucket/file.pdf)
+    processor_id: ID of an enabled Layout Parser processor (see setup_processor)
+    output_gcs_uri: GCS folder that receives the Document AI output (e.g., gs://bucket/docai_output/id/)
     chunk_size: Chunk size for layout parser
 
   Returns:
-    Extracted text content as string
+    Mapping of each successfully processed PDF path to the GCS URI of its output shards
   """
-  print(f"🔄 Processing PDF with Document AI Layout Parser: {pdf_gcs_path}")
+  print(f"🔄 Processing {len(pdf_gcs_paths)} PDF(s) with Document AI Layout Parser...")
 
   try:
-    # Ensure processor is setup and enabled before processing
-    processor_id = setup_processor(PROJECT_ID, DOCAI_LOCATION)
-    if not processor_id:
-      raise ValueError("Failed to setup Document AI Layout Parser processor")
-
-    print(f"✅ Using processor: {processor_id}")
-
-    # Initialize DocAI client
-    opts = ClientOptions(api_endpoint=f"{DOCAI_LOCATION}-documentai.googleapis.com")
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
-
-    # Download PDF content from GCS
-    storage_client = storage.Client(project=PROJECT_ID)
-    bucket_name = pdf_gcs_path.replace("gs://", "").split("/")[0]
-    blob_path = "/".join(pdf_gcs_path.replace("gs://", "").split("/")[1:])
-
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_path)
-    pdf_content = blob.download_as_bytes()
+    client = _get_docai_client(DOCAI_LOCATION)
 
     # Prepare the request
     processor_name = f"projects/{PROJECT_ID}/locations/{DOCAI_LOCATION}/processors/{processor_id}"
 
     # Configure the request
-    raw_document = documentai.RawDocument(
-        content=pdf_content,
-        mime_type="application/pdf"
+    input_config = documentai.BatchDocumentsInputConfig(
+        gcs_documents=documentai.GcsDocuments(
+            documents=[
+                documentai.GcsDocument(gcs_uri=pdf_gcs_path, mime_type="application/pdf")
+                for pdf_gcs_path in pdf_gcs_paths
+            ]
+        )
+    )
+    output_config = documentai.DocumentOutputConfig(
+        gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=output_gcs_uri)
     )
 
     # Configure layout processing options
@@ -267,146 +356,276 @@ def process_pdf_with_layout_parser(pdf_gcs_path: str, chunk_size: int = 1024) ->
 
     process_options = documentai.ProcessOptions(layout_config=layout_config)
 
-    request = documentai.ProcessRequest(
+    request = documentai.BatchProcessRequest(
         name=processor_name,
-        raw_document=raw_document,
+        input_documents=input_config,
+        document_output_config=output_config,
         process_options=process_options
     )
 
-    # Process the document
-    print("📄 Sending PDF to Document AI Layout Parser...")
-    result = client.process_document(request=request)
-
-    # Extract text from the result
-    text_content = extract_text_from_docai_response(result.document)
+    # Process all documents as one long-running operation
+    print("📄 Sending PDFs to Document AI Layout Parser...")
+    operation = client.batch_process_documents(request=request)
+    try:
+      operation.result(timeout=1800)
+    except TimeoutError:
+      # Stop DocAI from writing more output once the batch is given up on
+      operation.cancel()
+      raise
+
+    # Map each input PDF to the folder holding its output shards
+    metadata = documentai.BatchProcessMetadata(operation.metadata)
+    outputs = {}
+    for process_status in metadata.individual_process_statuses:
+      if process_status.status.code != 0:
+        print(f"❌ Document AI failed on {process_status.input_gcs_source}: {process_status.status.message}")
+        continue
+      outputs[process_status.input_gcs_source] = process_status.output_gcs_destination
 
-    print(f"✅ Successfully processed PDF. Extracted {len(text_content)} characters of text.")
-    return text_content
+    print(f"✅ Successfully processed {len(outputs)} of {len(pdf_gcs_paths)} PDF(s).")
+    return outputs
 
   except Exception as e:
-    print(f"❌ Error processing PDF with Document AI: {e}")
+    print(f"❌ Error processing PDFs with Document AI: {e}")
     raise
 
 
-def extract_text_from_docai_response(document) -> str:
-  """Extract formatted text from Document AI response.
+def load_docai_output(output_gcs_uri: str) -> List[documentai.Document]:
+  """Load the output shards Document AI wrote for one PDF.
 
   Args:
-    document: Document AI document response
+    output_gcs_uri: GCS URI of the folder holding the PDF's output shards
 
   Returns:
-    Formatted text content preserving document structure
+    Document AI output documents, one per output shard, in page order
   """
-  text_content = []
+  bucket_name, output_prefix = _parse_gs_uri(output_gcs_uri.rstrip("/") + "/")
+  output_blobs = _get_storage_client().list_blobs(bucket_name, prefix=output_prefix)
 
-  try:
-    # If document has chunked content, use that for better structure
-    if hasattr(document, 'chunked_document') and document.chunked_document:
-      print("📋 Using chunked document structure")
-      for chunk in document.chunked_document.chunks:
-        if hasattr(chunk, 'content') and chunk.content:
-          text_content.append(chunk.content)
+  # Read the shards in order (name-0.json, name-1.json, ..., name-10.json)
+  documents = []
+  for output_blob in sorted(output_blobs, key=lambda b: (len(b.name), b.name)):
+    if output_blob.name.endswith(".json"):
+      documents.append(documentai.Document.from_json(
+          output_blob.download_as_bytes(), ignore_unknown_fields=True
+      ))
 
-    # Fallback to document text if no chunks
-    elif hasattr(document, 'text') and document.text:
-      print("📋 Using document text")
-      text_content.append(document.text)
+  if not documents:
+    raise ValueError(f"Document AI produced no output at {output_gcs_uri}")
 
-    # Join all text content
-    full_text = "\n\n".join(text_content)
+  return documents
 
-    if not full_text.strip():
-      raise ValueError("No text content extracted from document")
 
-    return full_text
+def delete_docai_output(output_gcs_uri: str):
+  """Delete everything Document AI wrote under an output folder.
 
-  except Exception as e:
-    print(f"❌ Error extracting text from DocAI response: {e}")
-    raise
+  Args:
+    output_gcs_uri: GCS URI of the Document AI output folder
+  """
+  bucket_name, output_prefix = _parse_gs_uri(output_gcs_uri)
+  client = _get_storage_client()
+  output_blobs = list(client.list_blobs(bucket_name, prefix=output_prefix))
+  client.bucket(bucket_name).delete_blobs(output_blobs, on_error=lambda blob: None)
 
 
-def upload_processed_text_to_gcs(text_content: str, original_pdf_path: str) -> str:
-  """Upload processed text content to GCS as a .txt file.
+def iter_docai_chunks(document: documentai.Document) -> Iterator[str]:
+  """Yield the text of a Document AI response piece by piece.
 
   Args:
-    text_content: Extracted text content
-    original_pdf_path: Original PDF GCS path
+    document: Document AI document response
 
-  Returns:
-    GCS path to the uploaded text file
+  Yields:
+    Non-blank text chunks in document order, preserving document structure
   """
-  try:
-    # Generate text file path based on original PDF path
-    text_file_path = original_pdf_path.replace(".pdf", "_processed.txt")
+  # If document has chunked content, use that for better structure
+  if hasattr(document, 'chunked_document') and document.chunked_document:
+    for chunk in document.chunked_document.chunks:
+      if hasattr(chunk, 'content') and chunk.content.strip():
+        yield chunk.content
 
-    # Parse GCS path
-    bucket_name = text_file_path.replace("gs://", "").split("/")[0]
-    blob_path = "/".join(text_file_path.replace("gs://", "").split("/")[1:])
+  # Fallback to document text if no chunks
+  elif hasattr(document, 'text') and document.text.strip():
+    yield document.text
 
-    # Upload to GCS
-    client = storage.Client(project=PROJECT_ID)
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_path)
 
-    # Upload text content
-    blob.upload_from_string(text_content, content_type="text/plain")
+def write_processed_text(documents: List[documentai.Document], output_path: str) -> str:
+  """Stream the text of Document AI output to a local .txt file.
 
-    print(f"✅ Uploaded processed text to: {text_file_path}")
-    return text_file_path
+  Chunks are written as they are produced, so the full text is never held in
+  memory at once.
 
-  except Exception as e:
-    print(f"❌ Error uploading processed text to GCS: {e}")
-    raise
+  Args:
+    documents: Document AI output documents for the PDF
+    output_path: Local path of the text file to write
 
+  Returns:
+    Path to the written text file
+  """
+  chunks = (text for document in documents for text in iter_docai_chunks(document))
+  first_chunk = next(chunks, None)
+  if first_chunk is None:
+    raise ValueError("No text content extracted from document")
+
+  # Write chunks separated by blank lines
+  with open(output_path, "w", encoding="utf-8") as f:
+    f.write(first_chunk)
+    for text in chunks:
+      f.write("\n\n")
+      f.write(text)
 
-def parse_import_failures(partial_failures_sink: str, bucket_name: str) -> List[str]:
+  return output_path
+
+
+def parse_import_failures(partial_failures_sink: str, bucket_name: str, start_offset: int = 0) -> Tuple[List[str], int]:
   """Parse partial failures log to identify failed PDF files.
 
   Args:
     partial_failures_sink: GCS path to failures log
     bucket_name: GCS bucket name
+    start_offset: Byte offset in the log to resume reading from (default: 0)
 
   Returns:
-    List of failed PDF file paths
+    Tuple of the failed PDF file paths found after start_offset, each listed once
+    in first-seen order, and the byte offset to pass to the next call
   """
   failed_pdfs = []
+  seen_pdfs = set()  # The log can repeat a file once per embedding retry
+  offset = start_offset
 
   try:
-    client = storage.Client(project=PROJECT_ID)
+    client = _get_storage_client()
     bucket = client.bucket(bucket_name)
     blob_name = partial_failures_sink.replace(f"gs://{bucket_name}/", "")
     blob = bucket.blob(blob_name)
 
-    if not blob.exists():
-      print("⚠️  No failure log found")
-      return failed_pdfs
+    # Fetch the log's metadata to learn its size; it may not exist yet
+    try:
+      blob.reload()
+    except NotFound:
+      return failed_pdfs, offset
+
+    if blob.size <= start_offset:
+      return failed_pdfs, offset
 
-    # Read and parse failure log
-    error_logs = blob.download_as_text()
+    # Stream the failure log as raw bytes one NDJSON line at a time; only lines that
+    # can possibly match are decoded and parsed. The raw BlobReader has no peek(), so
+    # without a buffer line iteration falls back to one read(1) call per byte.
+    blob_reader = blob.open("rb")
+    blob_reader.seek(start_offset)
+    with io.BufferedReader(blob_reader, buffer_size=1 << 20) as error_logs:
+      for line in error_logs:
+        # Only skip past complete lines, so a line cut off at the end is read again
+        if line.endswith(b"\n"):
+          offset += len(line)
 
-    for line in error_logs.strip().split('\n'):
-      if not line.strip():
-        continue
+        if _INVALID_ARGUMENT_BYTES not in line or _PDF_NO_TEXT_MESSAGE_BYTES not in line:
+          continue
 
-      try:
-        log_entry = json.loads(line)
+        try:
+          log_entry = orjson.loads(line)
 
-        # Check if this is a PDF text extraction failure
-        if (log_entry.get("Status") == "INVALID_ARGUMENT" and
-            "PDF was invalid or file contains no text pages" in log_entry.get("Message", "") and
-            log_entry.get("Filename", "").endswith(".pdf")):
+          # Check if this is a PDF text extraction failure
+          if (log_entry.get("Status") == "INVALID_ARGUMENT" and
+              PDF_NO_TEXT_MESSAGE in log_entry.get("Message", "") and
+              log_entry.get("Filename", "").endswith(".pdf")):
 
-          failed_pdfs.append(log_entry["Filename"])
-          print(f"📄 Found failed PDF: {log_entry['Filename']}")
+            if log_entry["Filename"] not in seen_pdfs:
+              seen_pdfs.add(log_entry["Filename"])
+              failed_pdfs.append(log_entry["Filename"])
 
-      except json.JSONDecodeError:
-        continue
+        except orjson.JSONDecodeError:
+          continue
 
-    return failed_pdfs
+    return failed_pdfs, offset
 
   except Exception as e:
     print(f"⚠️  Error parsing import failures: {e}")
-    return failed_pdfs
+    return failed_pdfs, offset
+
+
+def _process_failed_pdf(output_gcs_uri: str, text_path: str) -> Union[str, Exception]:
+  """Turn one failed PDF's DocAI output into a local text file.
+
+  Args:
+    output_gcs_uri: GCS URI of the DocAI output shards for the PDF
+    text_path: Local path of the text file to write
+
+  Returns:
+    Path to the written text file, or the exception raised while processing
+  """
+  try:
+    # Load the Layout Parser output for the PDF
+    documents = load_docai_output(output_gcs_uri)
+
+    return write_processed_text(documents, text_path)
+
+  except Exception as pdf_error:
+    return pdf_error
+
+
+def _process_failed_pdfs(failed_pdfs: List[str], processor_id: str, corpus_name: str, bucket_name: str, transformation_config: TransformationConfig, chunk_size: int, pdf_executor: ThreadPoolExecutor) -> List:
+  """Run failed PDFs through DocAI and upload their text straight into the corpus.
+
+  Args:
+    failed_pdfs: GCS paths to the PDFs that failed to import
+    processor_id: ID of the Layout Parser processor to use
+    corpus_name: Name of the RAG corpus
+    bucket_name: GCS bucket that receives the DocAI output
+    transformation_config: Chunking configuration for the uploaded text
+    chunk_size: Chunk size for layout parser
+    pdf_executor: Worker pool shared by all batches for the per-PDF work
+
+  Returns:
+    RAG files created from the extracted text
+  """
+  uploaded_files = []
+
+  # DocAI reads the PDFs straight from GCS and writes its output back to GCS
+  output_uri = f"gs://{bucket_name}/docai_output/{uuid.uuid4().hex[:12]}/"
+
+  def upload_text(pdf_path: str, text_path: str):
+    return upload_pdf_to_corpus(
+        corpus_name,
+        text_path,
+        display_name=os.path.basename(pdf_path).replace(".pdf", "_processed.txt"),
+        description=f"Text extracted by Document AI Layout Parser from {pdf_path}",
+        transformation_config=transformation_config,
+    )
+
+  try:
+    # Process every failed PDF in one DocAI batch operation
+    try:
+      docai_outputs = process_pdfs_with_layout_parser(failed_pdfs, processor_id, output_uri, chunk_size)
+    except Exception as docai_error:
+      print(f"❌ Failed to process PDFs with DocAI: {docai_error}")
+      return uploaded_files
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      text_paths = [os.path.join(tmp_dir, f"{i}.txt") for i in range(len(docai_outputs))]
+
+      # Reading each output, writing its text and uploading it are independent per PDF,
+      # so run them concurrently
+      outcomes = pdf_executor.map(_process_failed_pdf, docai_outputs.values(), text_paths)
+      written_pdfs = []
+      for pdf_path, outcome in zip(docai_outputs, outcomes):
+        if isinstance(outcome, Exception):
+          print(f"❌ Failed to process PDF {pdf_path} with DocAI: {outcome}")
+          continue
+        written_pdfs.append((pdf_path, outcome))
+
+      # The text goes directly into the corpus, skipping a GCS copy and a second import
+      rag_files = pdf_executor.map(lambda args: upload_text(*args), written_pdfs)
+      uploaded_files = [rag_file for rag_file in rag_files if rag_file is not None]
+
+    return uploaded_files
+
+  finally:
+    # Remove all output of the batch, including shards of failed or unread PDFs, so
+    # later imports of the corpus bucket don't pick them up
+    try:
+      delete_docai_output(output_uri)
+    except Exception as cleanup_error:
+      print(f"⚠️  Could not delete Document AI output at {output_uri}: {cleanup_error}")
 
 
 def import_files_from_gcs(corpus_name: str, bucket_name: str, folder_path: str = "", chunk_size: int = 1024, chunk_overlap: int = 200):
@@ -441,32 +660,99 @@ def import_files_from_gcs(corpus_name: str, bucket_name: str, folder_path: str =
     )
 
     # Create a partial failures sink to capture detailed error information
-    timestamp = int(time.time())
-    partial_failures_sink = f"gs://{bucket_name}/rag_import_failures_{timestamp}.ndjson"
+    sink_id = uuid.uuid4().hex[:12]
+    partial_failures_sink = f"gs://{bucket_name}/rag_import_failures_{sink_id}.ndjson"
 
     # Import files from Cloud Storage using the RAG API
     print("Starting import operation from Cloud Storage...")
     print("This may take several minutes depending on file size and count...")
 
-    result = rag.import_files(
-        corpus_name=corpus_name,
-        paths=[gcs_uri],
-        transformation_config=transformation_config,
-        max_embedding_requests_per_min=1000,
-        timeout=600,
-        partial_failures_sink=partial_failures_sink
-    )
+    # Run the import in the background and tail the partial failures sink, so failed
+    # PDFs go to DocAI as soon as they are reported instead of after the import.
+    # Fallback batches share one per-PDF worker pool, which is shut down last.
+    with ThreadPoolExecutor(max_workers=DOCAI_MAX_WORKERS) as pdf_executor, \
+         ThreadPoolExecutor(max_workers=DOCAI_MAX_WORKERS + 1) as executor:
+      import_future = executor.submit(
+          rag.import_files,
+          corpus_name=corpus_name,
+          paths=[gcs_uri],
+          transformation_config=transformation_config,
+          max_embedding_requests_per_min=1000,
+          timeout=600,
+          partial_failures_sink=partial_failures_sink
+      )
+
+      fallback_futures = []
+      seen_pdfs = set()
+      log_offset = 0
+      processor_id = None
+      processor_checked = False
+      while True:
+        # Check before polling so the last poll sees the complete failure log
+        import_done = import_future.done()
+
+        # Each poll only reads the part of the log written since the previous one
+        failed_pdfs, log_offset = parse_import_failures(partial_failures_sink, bucket_name, log_offset)
+        new_pdfs = [pdf_path for pdf_path in failed_pdfs if pdf_path not in seen_pdfs]
+        if new_pdfs and not processor_checked:
+          print(f"\n🔄 Attempting to process failed PDFs with Document AI Layout Parser...")
+
+          # Try to setup processor once - if it fails, skip DocAI processing
+          processor_id = setup_processor(PROJECT_ID, DOCAI_LOCATION)
+          processor_checked = True
+          if not processor_id:
+            print("⚠️  Could not setup Document AI processor. Skipping DocAI processing.")
+            print("   Some files failed to import and cannot be processed.")
+          else:
+            print(f"✅ Using processor {processor_id} for failed PDF processing...")
+
+        if new_pdfs and processor_id:
+          for pdf_path in new_pdfs:
+            print(f"📄 Found failed PDF: {pdf_path}")
+          seen_pdfs.update(new_pdfs)
+          fallback_futures.append(
+              executor.submit(
+                  _process_failed_pdfs, new_pdfs, processor_id, corpus_name,
+                  bucket_name, transformation_config, chunk_size, pdf_executor
+              )
+          )
+
+        if import_done:
+          break
+        time.sleep(IMPORT_POLL_INTERVAL)
+
+      try:
+        result = import_future.result()
+      except Exception as import_error:
+        # Report the failure straight away instead of after the executor drains.
+        # Queued DocAI batches are cancelled; ones already started are waited for so the
+        # files they upload into the corpus are still reported.
+        print(f"❌ Import operation failed: {import_error}")
+        started_futures = [future for future in fallback_futures if not future.cancel()]
+        if started_futures:
+          print(f"⏳ Waiting for {len(started_futures)} Document AI batch(es) already started...")
+        uploaded_files = [rag_file for future in started_futures for rag_file in future.result()]
+        if uploaded_files:
+          print(f"⚠️  {len(uploaded_files)} files were uploaded after DocAI text extraction before the import failed.")
+        raise
+
+      uploaded_files = [rag_file for future in fallback_futures for rag_file in future.result()]
 
     print("✅ Import operation completed!")
     print(f"Import result: {result}")
 
-    if hasattr(result, 'imported_rag_files_count'):
-        print(f"✅ Imported files count: {result.imported_rag_files_count}")
-    if hasattr(result, 'skipped_rag_files_count'):
-        print(f"⏭️  Skipped files count: {result.skipped_rag_files_count}")
-    if hasattr(result, 'failed_rag_files_count'):
-        print(f"❌ Failed files count: {result.failed_rag_files_count}")
-        if result.failed_rag_files_count > 0:
+    # Read the counts once; any of them may be missing from the response
+    imported_count = getattr(result, 'imported_rag_files_count', None)
+    skipped_count = getattr(result, 'skipped_rag_files_count', None)
+    failed_count = getattr(result, 'failed_rag_files_count', None)
+
+    if imported_count is not None:
+        print(f"✅ Imported files count: {imported_count}")
+    if skipped_count is not None:
+        print(f"⏭️  Skipped files count: {skipped_count}")
+    if failed_count is not None:
+        print(f"❌ Failed files count: {failed_count}")
+        if failed_count > 0:
             print(f"💡 Partial failures sink: {partial_failures_sink}")
 
             # Try to read and display the error logs
@@ -474,7 +760,7 @@ def import_files_from_gcs(corpus_name: str, bucket_name: str, folder_path: str =
                 print("\n📋 Error Details from Partial Failures Log:")
                 print("=" * 60)
 
-                client = storage.Client(project=PROJECT_ID)
+                client = _get_storage_client()
                 bucket = client.bucket(bucket_name)
                 blob_name = partial_failures_sink.replace(f"gs://{bucket_name}/", "")
                 blob = bucket.blob(blob_name)
@@ -491,74 +777,12 @@ def import_files_from_gcs(corpus_name: str, bucket_name: str, folder_path: str =
 
             print("=" * 60)
 
-    # Check for failed PDFs and process them with DocAI if available
-    if (hasattr(result, 'failed_rag_files_count') and
-        result.failed_rag_files_count > 0):
-
-      print(f"\n🔄 Attempting to process failed PDFs with Document AI Layout Parser...")
-
-      # Try to setup processor - if it fails, skip DocAI processing
-      processor_id = setup_processor(PROJECT_ID, DOCAI_LOCATION)
-      if not processor_id:
-        print("⚠️  Could not setup Document AI processor. Skipping DocAI processing.")
-        print("   Some files failed to import and cannot be processed.")
-      else:
-        print(f"✅ Using processor {processor_id} for failed PDF processing...")
-        failed_pdfs = parse_import_failures(partial_failures_sink, bucket_name)
-
-        if failed_pdfs:
-          processed_files = []
-
-          for pdf_path in failed_pdfs:
-            try:
-              # Process PDF with DocAI Layout Parser
-              text_content = process_pdf_with_layout_parser(pdf_path, chunk_size)
-
-              # Upload processed text to GCS
-              text_file_path = upload_processed_text_to_gcs(text_content, pdf_path)
-              processed_files.append(text_file_path)
-
-            except Exception as pdf_error:
-              print(f"❌ Failed to process PDF {pdf_path} with DocAI: {pdf_error}")
-              continue
-
-          # Retry import with processed text files
-          if processed_files:
-            print(f"\n🔄 Retrying import with {len(processed_files)} processed text files...")
-
-            try:
-              retry_result = rag.import_files(
-                  corpus_name=corpus_name,
-                  paths=processed_files,
-                  transformation_config=transformation_config,
-                  max_embedding_requests_per_min=1000,
-                  timeout=600
-              )
-
-              print("✅ Retry import completed!")
-              print(f"Retry result: {retry_result}")
-
-              if hasattr(retry_result, 'imported_rag_files_count'):
-                  print(f"✅ Retry imported files count: {retry_result.imported_rag_files_count}")
-              if hasattr(retry_result, 'failed_rag_files_count'):
-                  print(f"❌ Retry failed files count: {retry_result.failed_rag_files_count}")
-
-              # Update success status if retry was successful
-              if (hasattr(retry_result, 'imported_rag_files_count') and
-                  retry_result.imported_rag_files_count > 0):
-                print("🎉 DocAI processing successful! Files imported after text extraction.")
-                return retry_result
-
-            except Exception as retry_error:
-              print(f"❌ Error in retry import: {retry_error}")
-
-    elif (hasattr(result, 'failed_rag_files_count') and
-          result.failed_rag_files_count > 0):
-      print("\n💡 Some files failed to import. Document AI Layout Parser will be automatically")
-      print("   configured if needed when processing failed PDFs.")
+    if uploaded_files:
+      print(f"🎉 DocAI processing successful! {len(uploaded_files)} files uploaded after text extraction.")
+      return result
 
     # Return success only if files were actually imported
-    if hasattr(result, 'imported_rag_files_count') and result.imported_rag_files_count > 0:
+    if imported_count is not None and imported_count > 0:
         return result
     else:
         print("⚠️  No files were successfully imported.")
@@ -600,8 +824,8 @@ def main():
   else:
     print(f"\n❌ Import failed. Please check the error messages above.")
 
-  # List all files in the corpus to verify the import
-  print(f"\n📋 Current files in corpus:")
+  # Count the files in the corpus to verify the import
+  print(f"\n📋 Checking files in corpus:")
   list_corpus_files(corpus_name=corpus.name)
 
 if __name__ == "__main__":
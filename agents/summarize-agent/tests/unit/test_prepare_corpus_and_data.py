@@ -0,0 +1,505 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Unit tests for the corpus preparation script.
+Cloud Storage, Document AI and the RAG API are replaced by in-memory fakes.
+"""
+
+import os
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import pytest
+from google.api_core.exceptions import NotFound
+from google.cloud import documentai, storage
+from google.cloud.storage.fileio import BlobReader
+from google.oauth2 import service_account
+
+# The module validates its configuration at import time
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "test-project")
+os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "us-central1")
+os.environ.setdefault("GCS_CORPUS_BUCKET_NAME", "test-bucket")
+
+from RAG.shared_libraries import prepare_corpus_and_data as prep  # noqa: E402
+
+BUCKET = "test-bucket"
+SINK = f"gs://{BUCKET}/rag_import_failures_test.ndjson"
+
+
+class FakeBlob:
+    """In-memory stand-in for storage.Blob, read through a real BlobReader."""
+
+    chunk_size = None
+
+    def __init__(self, blobs: dict, name: str) -> None:
+        self._blobs = blobs
+        self.name = name
+        self.size = None
+
+    def reload(self) -> None:
+        if self.name not in self._blobs:
+            raise NotFound(self.name)
+        self.size = len(self._blobs[self.name])
+
+    def open(self, mode: str = "r") -> BlobReader:
+        assert mode == "rb"
+        return BlobReader(self)
+
+    def download_as_bytes(self, start=0, end=None, **kwargs) -> bytes:
+        return self._blobs[self.name][start:end]
+
+    def delete(self) -> None:
+        self._blobs.pop(self.name, None)
+
+
+class FakeStorageClient:
+    """In-memory stand-in for storage.Client and storage.Bucket."""
+
+    def __init__(self, blobs: dict) -> None:
+        self.blobs = blobs
+
+    def bucket(self, bucket_name: str) -> "FakeStorageClient":
+        return self
+
+    def blob(self, blob_name: str) -> FakeBlob:
+        return FakeBlob(self.blobs, blob_name)
+
+    def list_blobs(self, bucket_name: str, prefix: str = "") -> list:
+        return [FakeBlob(self.blobs, name) for name in self.blobs if name.startswith(prefix)]
+
+    def delete_blobs(self, blobs: list, on_error=None) -> None:
+        for blob in blobs:
+            blob.delete()
+
+
+@pytest.fixture
+def blobs(monkeypatch: pytest.MonkeyPatch) -> dict:
+    """Returns the blob store backing the module's storage client."""
+    store = {}
+    monkeypatch.setattr(prep, "_get_storage_client", lambda: FakeStorageClient(store))
+    return store
+
+
+class FakeOperation:
+    """Stand-in for a DocAI batch operation that finishes or times out."""
+
+    def __init__(self, metadata: documentai.BatchProcessMetadata, timeout: bool = False) -> None:
+        self.metadata = metadata
+        self.timeout = timeout
+        self.cancelled = False
+
+    def result(self, timeout=None) -> None:
+        if self.timeout:
+            raise TimeoutError("operation timed out")
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class FakeDocAIClient:
+    """Stand-in for DocumentProcessorServiceClient that records batch requests."""
+
+    def __init__(self, operation: FakeOperation) -> None:
+        self.operation = operation
+        self.requests = []
+
+    def batch_process_documents(self, request: documentai.BatchProcessRequest) -> FakeOperation:
+        self.requests.append(request)
+        return self.operation
+
+
+def process_status(pdf_path: str, code: int = 0, output: str = "") -> documentai.BatchProcessMetadata.IndividualProcessStatus:
+    return documentai.BatchProcessMetadata.IndividualProcessStatus(
+        input_gcs_source=pdf_path, status={"code": code, "message": "failed" if code else ""},
+        output_gcs_destination=output,
+    )
+
+
+def failure_line(filename: str, status: str = "INVALID_ARGUMENT", message: str = prep.PDF_NO_TEXT_MESSAGE) -> bytes:
+    return orjson.dumps({"Filename": filename, "Status": status, "Message": message}) + b"\n"
+
+
+def test_storage_client_session_has_storage_scopes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Unscoped service account credentials get the Cloud Storage scopes."""
+    credentials = service_account.Credentials(
+        signer=object(),
+        service_account_email="test@test-project.iam.gserviceaccount.com",
+        token_uri="https://oauth2.googleapis.com/token",
+    )
+    assert credentials.requires_scopes
+    monkeypatch.setattr(prep, "_get_credentials", lambda: credentials)
+    prep._get_storage_client.cache_clear()
+
+    try:
+        client = prep._get_storage_client()
+    finally:
+        prep._get_storage_client.cache_clear()
+
+    assert set(client._http.credentials.scopes) == set(storage.Client.SCOPE)
+
+
+def test_parse_import_failures_filters_lines(blobs: dict) -> None:
+    """Only PDF text extraction failures are returned; bad JSON is skipped."""
+    blobs["rag_import_failures_test.ndjson"] = b"".join([
+        failure_line("gs://test-bucket/ok.pdf", status="OK", message="imported"),
+        failure_line("gs://test-bucket/a.pdf"),
+        failure_line("gs://test-bucket/notes.txt"),
+        failure_line("gs://test-bucket/c.pdf", message="Quota exceeded"),
+        # Passes the bytes prefilter but is not valid JSON
+        b'{"Status": "INVALID_ARGUMENT", "Message": "' + prep._PDF_NO_TEXT_MESSAGE_BYTES + b'"\n',
+        failure_line("gs://test-bucket/b.pdf"),
+    ])
+
+    failed_pdfs, _ = prep.parse_import_failures(SINK, BUCKET)
+
+    assert failed_pdfs == ["gs://test-bucket/a.pdf", "gs://test-bucket/b.pdf"]
+
+
+def test_parse_import_failures_dedups_in_first_seen_order(blobs: dict) -> None:
+    """A PDF repeated in the log is returned once, at its first position."""
+    blobs["rag_import_failures_test.ndjson"] = b"".join([
+        failure_line("gs://test-bucket/b.pdf"),
+        failure_line("gs://test-bucket/a.pdf"),
+        failure_line("gs://test-bucket/b.pdf"),
+        failure_line("gs://test-bucket/a.pdf"),
+    ])
+
+    failed_pdfs, _ = prep.parse_import_failures(SINK, BUCKET)
+
+    assert failed_pdfs == ["gs://test-bucket/b.pdf", "gs://test-bucket/a.pdf"]
+
+
+def test_parse_gs_uri() -> None:
+    assert prep._parse_gs_uri("gs://bucket/a/b/file.pdf") == ("bucket", "a/b/file.pdf")
+    assert prep._parse_gs_uri("gs://bucket/prefix/") == ("bucket", "prefix/")
+
+
+def test_write_processed_text_joins_chunks(tmp_path) -> None:
+    """Non-blank chunks are written in order, falling back to the document text."""
+    Chunk = documentai.Document.ChunkedDocument.Chunk
+    chunked = documentai.Document(
+        text="ignored when chunks exist",
+        chunked_document=documentai.Document.ChunkedDocument(
+            chunks=[Chunk(content="# Title"), Chunk(content="  "), Chunk(content="Body")]
+        ),
+    )
+    plain = documentai.Document(text="Appendix")
+    output_path = tmp_path / "out.txt"
+
+    assert prep.write_processed_text([chunked, plain], str(output_path)) == str(output_path)
+    assert output_path.read_text(encoding="utf-8") == "# Title\n\nBody\n\nAppendix"
+
+
+def test_write_processed_text_without_text(tmp_path) -> None:
+    output_path = tmp_path / "out.txt"
+
+    with pytest.raises(ValueError):
+        prep.write_processed_text([documentai.Document(text=" \n")], str(output_path))
+    assert not output_path.exists()
+
+
+def test_setup_processor_uses_configured_id(monkeypatch: pytest.MonkeyPatch) -> None:
+    """DOCAI_PROCESSOR_ID is returned without looking up processors."""
+    monkeypatch.setattr(prep, "DOCAI_PROCESSOR_ID", "configured-id")
+    monkeypatch.setattr(prep, "_setup_processor", lambda *args: pytest.fail("unexpected lookup"))
+
+    assert prep.setup_processor("test-project", "us") == "configured-id"
+
+
+def test_setup_processor_caches_only_successes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A failed lookup is retried on the next call; a successful one is reused."""
+    results = [None, "processor-id"]
+    calls = []
+
+    def fake_setup_processor(project_id: str, location: str, processor_display_name: str) -> str:
+        calls.append((project_id, location))
+        return results[len(calls) - 1]
+
+    monkeypatch.setattr(prep, "DOCAI_PROCESSOR_ID", None)
+    monkeypatch.setattr(prep, "_processor_ids", {})
+    monkeypatch.setattr(prep, "_setup_processor", fake_setup_processor)
+
+    assert prep.setup_processor("test-project", "us") is None
+    assert prep.setup_processor("test-project", "us") == "processor-id"
+    assert prep.setup_processor("test-project", "us") == "processor-id"
+    assert len(calls) == 2
+
+
+def test_process_pdfs_with_layout_parser_maps_outputs(monkeypatch: pytest.MonkeyPatch) -> None:
+    """All PDFs go in one batch and only successful ones are mapped to their output."""
+    operation = FakeOperation(documentai.BatchProcessMetadata(individual_process_statuses=[
+        process_status("gs://test-bucket/a.pdf", output="gs://test-bucket/docai_output/id/0"),
+        process_status("gs://test-bucket/b.pdf", code=3),
+        process_status("gs://test-bucket/c.pdf", output="gs://test-bucket/docai_output/id/2"),
+    ]))
+    client = FakeDocAIClient(operation)
+    monkeypatch.setattr(prep, "_get_docai_client", lambda location: client)
+
+    outputs = prep.process_pdfs_with_layout_parser(
+        ["gs://test-bucket/a.pdf", "gs://test-bucket/b.pdf", "gs://test-bucket/c.pdf"],
+        "processor-id", "gs://test-bucket/docai_output/id/",
+    )
+
+    assert outputs == {
+        "gs://test-bucket/a.pdf": "gs://test-bucket/docai_output/id/0",
+        "gs://test-bucket/c.pdf": "gs://test-bucket/docai_output/id/2",
+    }
+    (request,) = client.requests
+    assert len(request.input_documents.gcs_documents.documents) == 3
+    assert request.document_output_config.gcs_output_config.gcs_uri == "gs://test-bucket/docai_output/id/"
+
+
+def test_process_pdfs_with_layout_parser_cancels_on_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    operation = FakeOperation(documentai.BatchProcessMetadata(), timeout=True)
+    monkeypatch.setattr(prep, "_get_docai_client", lambda location: FakeDocAIClient(operation))
+
+    with pytest.raises(TimeoutError):
+        prep.process_pdfs_with_layout_parser(["gs://test-bucket/a.pdf"], "processor-id", "gs://test-bucket/docai_output/id/")
+    assert operation.cancelled
+
+
+def test_load_docai_output_reads_shards_in_page_order(blobs: dict) -> None:
+    """Shards are read in numeric order and non-JSON files are ignored."""
+    for shard in (10, 2, 0, 1):
+        document = documentai.Document(text=f"shard {shard}")
+        blobs[f"docai_output/id/0/doc-{shard}.json"] = documentai.Document.to_json(document).encode()
+    blobs["docai_output/id/0/notes.txt"] = b"not a shard"
+    blobs["docai_output/id/1/doc-0.json"] = documentai.Document.to_json(documentai.Document(text="other")).encode()
+
+    documents = prep.load_docai_output("gs://test-bucket/docai_output/id/0")
+
+    assert [document.text for document in documents] == ["shard 0", "shard 1", "shard 2", "shard 10"]
+
+
+def test_load_docai_output_without_shards(blobs: dict) -> None:
+    with pytest.raises(ValueError):
+        prep.load_docai_output("gs://test-bucket/docai_output/missing/")
+
+
+def fake_batch(blobs: dict, outputs: dict):
+    """Returns a process_pdfs_with_layout_parser stand-in that writes one shard per PDF."""
+    def process_pdfs(pdf_gcs_paths, processor_id, output_gcs_uri, chunk_size=1024):
+        _, output_prefix = prep._parse_gs_uri(output_gcs_uri)
+        results = {}
+        for i, pdf_path in enumerate(pdf_gcs_paths):
+            text = outputs[pdf_path]
+            blobs[f"{output_prefix}{i}/doc-0.json"] = documentai.Document.to_json(documentai.Document(text=text)).encode()
+            if text:
+                results[pdf_path] = f"{output_gcs_uri}{i}"
+        return results
+    return process_pdfs
+
+
+def run_failed_pdfs(failed_pdfs: list) -> list:
+    with ThreadPoolExecutor(max_workers=2) as pdf_executor:
+        return prep._process_failed_pdfs(failed_pdfs, "processor-id", "corpus", BUCKET, None, 1024, pdf_executor)
+
+
+def test_process_failed_pdfs_uploads_text_and_cleans_up(blobs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Extracted text is uploaded and all DocAI output is deleted, even for failed PDFs."""
+    uploads = []
+
+    def fake_upload(corpus_name, pdf_path, display_name, description, transformation_config=None):
+        with open(pdf_path, encoding="utf-8") as f:
+            uploads.append((display_name, f.read()))
+        return display_name
+
+    monkeypatch.setattr(prep, "process_pdfs_with_layout_parser", fake_batch(blobs, {
+        "gs://test-bucket/a.pdf": "text of a", "gs://test-bucket/b.pdf": "",
+    }))
+    monkeypatch.setattr(prep, "upload_pdf_to_corpus", fake_upload)
+
+    uploaded_files = run_failed_pdfs(["gs://test-bucket/a.pdf", "gs://test-bucket/b.pdf"])
+
+    assert uploaded_files == ["a_processed.txt"]
+    assert uploads == [("a_processed.txt", "text of a")]
+    assert blobs == {}
+
+
+def test_process_failed_pdfs_cleans_up_when_batch_fails(blobs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    def failing_batch(pdf_gcs_paths, processor_id, output_gcs_uri, chunk_size=1024):
+        fake_batch(blobs, {"gs://test-bucket/a.pdf": "text of a"})(pdf_gcs_paths, processor_id, output_gcs_uri)
+        raise TimeoutError("operation timed out")
+
+    monkeypatch.setattr(prep, "process_pdfs_with_layout_parser", failing_batch)
+
+    assert run_failed_pdfs(["gs://test-bucket/a.pdf"]) == []
+    assert blobs == {}
+
+
+def test_process_failed_pdfs_cleans_up_when_upload_fails(blobs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    def failing_upload(*args, **kwargs):
+        raise RuntimeError("upload failed")
+
+    monkeypatch.setattr(prep, "process_pdfs_with_layout_parser", fake_batch(blobs, {"gs://test-bucket/a.pdf": "text of a"}))
+    monkeypatch.setattr(prep, "upload_pdf_to_corpus", failing_upload)
+
+    with pytest.raises(RuntimeError):
+        run_failed_pdfs(["gs://test-bucket/a.pdf"])
+    assert blobs == {}
+
+
+def test_parse_import_failures_resumes_from_offset(blobs: dict) -> None:
+    """A later call only reads lines written after the returned offset."""
+    first = failure_line("gs://test-bucket/a.pdf")
+    blobs["rag_import_failures_test.ndjson"] = first
+    assert prep.parse_import_failures(SINK, BUCKET) == (["gs://test-bucket/a.pdf"], len(first))
+
+    second = failure_line("gs://test-bucket/b.pdf")
+    blobs["rag_import_failures_test.ndjson"] = first + second
+    failed_pdfs, offset = prep.parse_import_failures(SINK, BUCKET, len(first))
+
+    assert failed_pdfs == ["gs://test-bucket/b.pdf"]
+    assert offset == len(first) + len(second)
+    assert prep.parse_import_failures(SINK, BUCKET, offset) == ([], offset)
+
+
+def test_parse_import_failures_rereads_unterminated_line(blobs: dict) -> None:
+    """A last line without a newline is parsed but read again on the next call."""
+    first = failure_line("gs://test-bucket/a.pdf")
+    blobs["rag_import_failures_test.ndjson"] = first + failure_line("gs://test-bucket/b.pdf").rstrip(b"\n")
+
+    failed_pdfs, offset = prep.parse_import_failures(SINK, BUCKET)
+
+    assert failed_pdfs == ["gs://test-bucket/a.pdf", "gs://test-bucket/b.pdf"]
+    assert offset == len(first)
+
+
+def test_parse_import_failures_missing_log(blobs: dict) -> None:
+    """A log that has not been written yet yields no failures."""
+    assert prep.parse_import_failures(SINK, BUCKET, 7) == ([], 7)
+
+
+class ImportScenario:
+    """Drives import_files_from_gcs with scripted failure log polls.
+
+    rag.import_files blocks until every scripted poll has been served, so each
+    poll happens while the import is still running.
+    """
+
+    def __init__(self, monkeypatch: pytest.MonkeyPatch, blobs: dict, polls: list, processor_id="processor-id") -> None:
+        self.polls = polls
+        self.offsets = []
+        self.batches = []
+        self.uploads = []
+        self.setup_calls = 0
+        self.processor_id = processor_id
+        self.import_error = None
+        self.polls_served = threading.Event()
+        self.release_batches = threading.Event()
+        self.release_batches.set()
+        self.write_batch = fake_batch(blobs, {pdf: f"text of {pdf}" for poll in polls for pdf in poll})
+
+        monkeypatch.setattr(prep, "IMPORT_POLL_INTERVAL", 0)
+        monkeypatch.setattr(prep, "parse_import_failures", self.parse_import_failures)
+        monkeypatch.setattr(prep, "setup_processor", self.setup_processor)
+        monkeypatch.setattr(prep, "process_pdfs_with_layout_parser", self.process_pdfs)
+        monkeypatch.setattr(prep.rag, "import_files", self.import_files)
+        monkeypatch.setattr(prep.rag, "upload_file", self.upload_file)
+
+    def parse_import_failures(self, partial_failures_sink: str, bucket_name: str, start_offset: int = 0):
+        self.offsets.append(start_offset)
+        if len(self.offsets) > len(self.polls):
+            self.polls_served.set()
+            return [], start_offset
+        return self.polls[len(self.offsets) - 1], start_offset + 100
+
+    def setup_processor(self, project_id: str, location: str) -> str:
+        self.setup_calls += 1
+        return self.processor_id
+
+    def process_pdfs(self, pdf_gcs_paths, processor_id, output_gcs_uri, chunk_size=1024):
+        self.batches.append(list(pdf_gcs_paths))
+        assert self.release_batches.wait(5)
+        return self.write_batch(pdf_gcs_paths, processor_id, output_gcs_uri)
+
+    def import_files(self, **kwargs):
+        assert self.polls_served.wait(5)
+        if self.import_error:
+            raise self.import_error
+        return types.SimpleNamespace(imported_rag_files_count=1, skipped_rag_files_count=0, failed_rag_files_count=0)
+
+    def upload_file(self, corpus_name, path, display_name, description, transformation_config=None):
+        self.uploads.append(display_name)
+        return types.SimpleNamespace(name=display_name)
+
+
+def test_import_files_from_gcs_batches_each_pdf_once(blobs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Each poll resumes at the previous offset and PDFs seen before are not sent again."""
+    scenario = ImportScenario(monkeypatch, blobs, polls=[
+        ["gs://test-bucket/a.pdf"],
+        [],
+        ["gs://test-bucket/a.pdf", "gs://test-bucket/b.pdf"],
+    ])
+
+    result = prep.import_files_from_gcs("corpus", BUCKET)
+
+    assert result.imported_rag_files_count == 1
+    assert scenario.offsets[:4] == [0, 100, 200, 300]
+    assert scenario.batches == [["gs://test-bucket/a.pdf"], ["gs://test-bucket/b.pdf"]]
+    assert sorted(scenario.uploads) == ["a_processed.txt", "b_processed.txt"]
+    assert scenario.setup_calls == 1
+    assert blobs == {}
+
+
+def test_import_files_from_gcs_skips_docai_without_processor(blobs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A processor setup failure is checked once and no batch is sent."""
+    scenario = ImportScenario(monkeypatch, blobs, processor_id=None, polls=[
+        ["gs://test-bucket/a.pdf"],
+        ["gs://test-bucket/b.pdf"],
+    ])
+
+    result = prep.import_files_from_gcs("corpus", BUCKET)
+
+    assert result.imported_rag_files_count == 1
+    assert scenario.setup_calls == 1
+    assert scenario.batches == []
+    assert scenario.uploads == []
+
+
+def test_import_files_from_gcs_failed_import_waits_for_started_batches(blobs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Queued batches are cancelled and started ones finish before None is returned."""
+    monkeypatch.setattr(prep, "DOCAI_MAX_WORKERS", 1)
+    scenario = ImportScenario(monkeypatch, blobs, polls=[
+        ["gs://test-bucket/a.pdf"],
+        ["gs://test-bucket/b.pdf"],
+        ["gs://test-bucket/c.pdf"],
+    ])
+    scenario.import_error = RuntimeError("import failed")
+
+    # Hold every batch until the failed import has cancelled the queued ones
+    scenario.release_batches.clear()
+    messages = []
+
+    def record_print(*args, **kwargs):
+        message = " ".join(str(arg) for arg in args)
+        messages.append(message)
+        if message.startswith("⏳"):
+            scenario.release_batches.set()
+
+    monkeypatch.setattr(prep, "print", record_print, raising=False)
+
+    assert prep.import_files_from_gcs("corpus", BUCKET) is None
+
+    # a holds the only batch worker; b may take the import's thread once it fails; c stays queued
+    started = [pdf for batch in scenario.batches for pdf in batch]
+    assert started[0] == "gs://test-bucket/a.pdf"
+    assert "gs://test-bucket/c.pdf" not in started
+    assert sorted(scenario.uploads) == sorted(
+        os.path.basename(pdf).replace(".pdf", "_processed.txt") for pdf in started
+    )
+    assert any(message.startswith("⏳") for message in messages)
+    assert blobs == {}